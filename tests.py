@@ -13,7 +13,7 @@ from dateutil.tz import tzutc
 from dateutil.rrule import rrule, rruleset, WEEKLY, MONTHLY
 
 from vobject import base, iCalendar
-from vobject import icalendar
+from vobject import icalendar, vcard
 
 from vobject.base import __behaviorRegistry as behavior_registry
 from vobject.base import ContentLine, parseLine, ParseError
@@ -24,7 +24,7 @@ from vobject.change_tz import change_tz
 from vobject.icalendar import MultiDateBehavior, PeriodBehavior, \
     RecurringComponent, utc
 from vobject.icalendar import parseDtstart, stringToTextValues, \
-    stringToPeriod, timedeltaToString
+    stringToPeriod, stringToDurations, timedeltaToString
 
 two_hours = datetime.timedelta(hours=2)
 
@@ -528,6 +528,24 @@ class TestVcards(unittest.TestCase):
             self.assertEqual(new_card.org.value, card.org.value)
             card = new_card
 
+    def test_base64_round_trip(self):
+        """
+        Text and binary values with ENCODING=b survive serializing
+        """
+        card = base.newFromBehavior('vcard', '3.0')
+        card.add('fn').value = 'Test'
+        card.add('n').value = vcard.Name(family='Test')
+        note = card.add('note')
+        note.value = u'Hello, w\xf6rld'
+        note.encoding_param = 'b'
+        key = card.add('key')
+        key.value = b'\x00\x01binary\xff' * 10
+        key.encoding_param = 'b'
+
+        new_card = base.readOne(card.serialize())
+        self.assertEqual(new_card.note.value, u'Hello, w\xf6rld'.encode('utf-8'))
+        self.assertEqual(new_card.key.value, b'\x00\x01binary\xff' * 10)
+
 
 class TestIcalendar(unittest.TestCase):
     """
@@ -592,6 +610,43 @@ class TestIcalendar(unittest.TestCase):
             stringToTextValues('abcd,efgh'),
             ['abcd', 'efgh']
         )
+        self.assertEqual(
+            stringToTextValues('a\\,b\\nc,d\\:e'),
+            ['a,b\nc', 'd\\:e']
+        )
+
+    def test_stringToDurations(self):
+        """
+        Test duration strings
+        """
+        self.assertEqual(
+            stringToDurations('-P1DT2H3M4S'),
+            [-datetime.timedelta(days=1, hours=2, minutes=3, seconds=4)]
+        )
+        self.assertEqual(
+            stringToDurations('P1W,PT15M'),
+            [datetime.timedelta(weeks=1), datetime.timedelta(minutes=15)]
+        )
+        self.assertRaises(ParseError, stringToDurations, 'P1X')
+        # a sign and P without any field isn't a duration
+        self.assertRaises(ParseError, stringToDurations, '-P')
+
+    def test_stringToDateTime(self):
+        """
+        Test DATE-TIME strings
+        """
+        self.assertEqual(
+            icalendar.stringToDateTime('20080123T100032Z'),
+            datetime.datetime(2008, 1, 23, 10, 0, 32, tzinfo=utc)
+        )
+        self.assertEqual(
+            icalendar.stringToDateTime(' 20080123T100032 '),
+            datetime.datetime(2008, 1, 23, 10, 0, 32)
+        )
+        # every field needs all of its digits
+        for value in ('20281201T11004', '2008012 T100032',
+                      '20200407T1150 0x'):
+            self.assertRaises(ParseError, icalendar.stringToDateTime, value)
 
     def test_stringToPeriod(self):
         """
@@ -636,6 +691,34 @@ class TestIcalendar(unittest.TestCase):
         delta = datetime.timedelta(hours=9, minutes=30)
         self.assertEqual(icalendar.deltaToOffset(delta), "+0930")
 
+    def test_getTransitionOccurrence(self):
+        """Test getTransitionOccurrence() function."""
+        # second Sunday of March 2007, US DST start
+        self.assertEqual(
+            icalendar.getTransitionOccurrence(2007, 3, 6, 2, 2),
+            datetime.datetime(2007, 3, 11, 2)
+        )
+        # last Sunday of October 2024, EU DST end
+        self.assertEqual(
+            icalendar.getTransitionOccurrence(2024, 10, 6, -1, 1),
+            datetime.datetime(2024, 10, 27, 1)
+        )
+        # February 2015 has no fifth Monday, 2016 does
+        self.assertEqual(
+            icalendar.getTransitionOccurrence(2015, 2, 0, 5, 2),
+            datetime.datetime(2016, 2, 29, 2)
+        )
+        # whole year offsets start on new year's day
+        self.assertEqual(
+            icalendar.getTransitionOccurrence(2010, 4, 6, None, None),
+            datetime.datetime(2010, 1, 1)
+        )
+        # no month has a zeroth or sixth Monday
+        self.assertRaises(ValueError, icalendar.getTransitionOccurrence,
+                          2024, 2, 0, 0, 2)
+        self.assertRaises(ValueError, icalendar.getTransitionOccurrence,
+                          2024, 2, 0, 6, 2)
+
     def test_vtimezone_creation(self):
         """
         Test timezones
@@ -657,6 +740,111 @@ class TestIcalendar(unittest.TestCase):
                                        tzinfo=tzs.get('Santiago'))
                 self.assertTrue(dt.replace(tzinfo=tzs.get('Santiago')), dt)
 
+    def test_vtimezone_tzinfo_cache(self):
+        """
+        Parsed VTIMEZONE tzinfo is reused until the component changes
+        """
+        cal = base.readOne(get_test_file("ms_tzid.ics"))
+        vtz = cal.vtimezone
+        tzid = vtz.tzid.value
+        # put the registry back the way parsing left it
+        self.addCleanup(icalendar.registerTzid, tzid, icalendar.getTzid(tzid))
+
+        # make sure the definition is parsed instead of the registered one
+        icalendar.registerTzid(tzid, None)
+        tzinfo = vtz.tzinfo
+        self.assertIs(vtz.tzinfo, tzinfo)
+        # TZURL isn't part of the definition tzical sees
+        vtz.add('tzurl').value = u'http://example.com/tz'
+        self.assertIs(vtz.tzinfo, tzinfo)
+
+        # edits inside STANDARD and DAYLIGHT are picked up
+        for comp in vtz.components():
+            comp.tzoffsetto.value = '+0300'
+        self.assertEqual(vtz.tzinfo.utcoffset(datetime.datetime(2010, 1, 1)),
+                         datetime.timedelta(hours=3))
+
+        registered = dateutil.tz.gettz('Australia/Sydney')
+        icalendar.registerTzid(tzid, registered)
+        self.assertIs(vtz.tzinfo, registered)
+
+    def test_global_tzid(self):
+        """
+        Globally unique TZIDs with a leading solidus resolve like plain ones
+        """
+        try:
+            import pytz
+        except ImportError:
+            return self.skipTest("pytz not installed")  # NOQA
+
+        self.assertEqual(icalendar.getTzid('/Europe/Stockholm'),
+                         pytz.timezone('Europe/Stockholm'))
+
+    def test_global_tzid_vtimezone(self):
+        """
+        A VTIMEZONE whose TZID has a leading solidus doesn't describe TZID
+        parameters without one, those need their own VTIMEZONE
+        """
+        try:
+            import pytz
+        except ImportError:
+            return self.skipTest("pytz not installed")  # NOQA
+
+        cal = base.readOne(
+            "BEGIN:VCALENDAR\r\n"
+            "VERSION:2.0\r\n"
+            "PRODID:-//Test//EN\r\n"
+            "BEGIN:VTIMEZONE\r\n"
+            "TZID:/Europe/Stockholm\r\n"
+            "BEGIN:STANDARD\r\n"
+            "DTSTART:19701025T030000\r\n"
+            "RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=10\r\n"
+            "TZOFFSETFROM:+0200\r\n"
+            "TZOFFSETTO:+0100\r\n"
+            "END:STANDARD\r\n"
+            "END:VTIMEZONE\r\n"
+            "END:VCALENDAR\r\n"
+        )
+        vevent = cal.add('vevent')
+        vevent.add('uid').value = 'test'
+        vevent.add('dtstart').value = pytz.timezone('Europe/Stockholm').localize(
+            datetime.datetime(2024, 1, 5, 10))
+        serialized = cal.serialize()
+        self.assertIn('DTSTART;TZID=Europe/Stockholm:', serialized)
+        self.assertIn('TZID:/Europe/Stockholm\r\n', serialized)
+        self.assertIn('TZID:Europe/Stockholm\r\n', serialized)
+
+    def test_rdate_list_tzid(self):
+        """
+        Time zones used only inside multi-valued lines get a VTIMEZONE
+        """
+        try:
+            import pytz
+        except ImportError:
+            return self.skipTest("pytz not installed")  # NOQA
+
+        paris = pytz.timezone('Europe/Paris')
+        cal = iCalendar()
+        vevent = cal.add('vevent')
+        vevent.add('dtstart').value = datetime.datetime(2024, 1, 1, tzinfo=utc)
+        vevent.add('rdate').value = [paris.localize(
+            datetime.datetime(2024, 2, 1, 10))]
+        self.assertIn('TZID:Europe/Paris', cal.serialize())
+
+    def test_unknown_tzid(self):
+        """
+        Failed lookups are remembered until the tzid is registered
+        """
+        # leave the registry as it was
+        self.addCleanup(icalendar._unknownTzids.discard, 'Not A Zone')
+        self.addCleanup(getattr(icalendar, '__tzidMap').pop, 'Not A Zone',
+                        None)
+
+        self.assertIsNone(icalendar.getTzid('Not A Zone'))
+        self.assertIsNone(icalendar.getTzid('Not A Zone'))
+        icalendar.registerTzid('Not A Zone', utc)
+        self.assertIs(icalendar.getTzid('Not A Zone'), utc)
+
     @staticmethod
     def test_timezone_serializing():
         """
@@ -716,6 +904,28 @@ class TestIcalendar(unittest.TestCase):
             tz = icalendar.TimezoneComponent(tzinfo=pytz.timezone(tzname))
             tz.serialize()
 
+    def test_generated_vtimezone_widens(self):
+        """
+        A generated VTIMEZONE grows to cover events added after serializing
+        """
+        eastern = dateutil.tz.gettz('US/Eastern')
+        cal = base.Component('VCALENDAR')
+        cal.setBehavior(icalendar.VCalendar2_0)
+        ev = cal.add('vevent')
+        ev.add('dtstart').value = datetime.datetime(2024, 1, 5, 10,
+                                                    tzinfo=eastern)
+        serialized = cal.serialize()
+        self.assertNotIn('DTSTART:20040404T020000', serialized)
+
+        ev = cal.add('vevent')
+        ev.add('dtstart').value = datetime.datetime(2005, 3, 20, 10,
+                                                    tzinfo=eastern)
+        serialized = cal.serialize()
+        self.assertEqual(len(cal.vtimezone_list), 1)
+        # the pre-2007 daylight rule is described again
+        self.assertIn('DTSTART:20040404T020000', serialized)
+        self.assertIn('UNTIL=20060402T070000Z', serialized)
+
     def test_freeBusy(self):
         """
         Test freebusy components
@@ -819,6 +1029,90 @@ class TestIcalendar(unittest.TestCase):
             list(vevent.getrruleset(True)),
             [datetime.datetime(2005, 3, 18, 0, 0), datetime.datetime(2005, 3, 29, 0, 0)]
         )
+        # parsed rules are reused, make sure COUNT isn't adjusted twice
+        self.assertEqual(
+            list(vevent.getrruleset(True)),
+            [datetime.datetime(2005, 3, 18, 0, 0), datetime.datetime(2005, 3, 29, 0, 0)]
+        )
+
+        # round trip an nth-weekday rule through setrruleset
+        vevent.dtstart.value = datetime.datetime(2005, 1, 30, 9)
+        evruleset = rruleset()
+        evruleset.rrule(rrule(MONTHLY, count=3, byweekday=dateutil.rrule.SU(-1),
+                              dtstart=vevent.dtstart.value))
+        vevent.rruleset = evruleset
+        self.assertEqual(vevent.rrule.value, "FREQ=MONTHLY;COUNT=3;BYDAY=-1SU")
+
+    def test_rruleFromString(self):
+        """
+        Test RRULE parsing, both the common subset handled directly and rules
+        left to dateutil's rrulestr
+        """
+        def dates(value, dtstart):
+            return list(icalendar.rruleFromString(value, dtstart))
+
+        eastern = dateutil.tz.gettz('America/New_York')
+
+        # BYDAY with ordinals
+        self.assertEqual(
+            dates('FREQ=MONTHLY;COUNT=3;BYDAY=-1SU',
+                  datetime.datetime(2024, 1, 28, 9)),
+            [datetime.datetime(2024, 1, 28, 9), datetime.datetime(2024, 2, 25, 9),
+             datetime.datetime(2024, 3, 31, 9)]
+        )
+        self.assertEqual(
+            dates('FREQ=MONTHLY;COUNT=3;BYDAY=+2MO',
+                  datetime.datetime(2024, 1, 8, 9)),
+            [datetime.datetime(2024, 1, 8, 9), datetime.datetime(2024, 2, 12, 9),
+             datetime.datetime(2024, 3, 11, 9)]
+        )
+
+        # date-only UNTIL takes DTSTART's time when DTSTART has a time zone,
+        # and means midnight for floating DTSTARTs
+        self.assertEqual(
+            dates('FREQ=DAILY;UNTIL=20240103',
+                  datetime.datetime(2024, 1, 1, 9, tzinfo=eastern)),
+            [datetime.datetime(2024, 1, day, 9, tzinfo=eastern)
+             for day in (1, 2, 3)]
+        )
+        self.assertEqual(
+            dates('FREQ=DAILY;UNTIL=20240103', datetime.datetime(2024, 1, 1, 9)),
+            [datetime.datetime(2024, 1, 1, 9), datetime.datetime(2024, 1, 2, 9)]
+        )
+
+        # UTC UNTIL is compared in DTSTART's time zone, or as floating
+        self.assertEqual(
+            dates('FREQ=DAILY;UNTIL=20240103T140000Z',
+                  datetime.datetime(2024, 1, 1, 9, tzinfo=eastern)),
+            [datetime.datetime(2024, 1, day, 9, tzinfo=eastern)
+             for day in (1, 2, 3)]
+        )
+        self.assertEqual(
+            dates('FREQ=DAILY;UNTIL=20240102T140000Z',
+                  datetime.datetime(2024, 1, 1, 9)),
+            [datetime.datetime(2024, 1, 1, 9), datetime.datetime(2024, 1, 2, 9)]
+        )
+
+        # WKST changes which weeks INTERVAL skips (RFC 5545 example)
+        self.assertEqual(
+            dates('FREQ=WEEKLY;INTERVAL=2;COUNT=4;BYDAY=TU,SU;WKST=MO',
+                  datetime.datetime(1997, 8, 5, 9)),
+            [datetime.datetime(1997, 8, day, 9) for day in (5, 10, 19, 24)]
+        )
+        self.assertEqual(
+            dates('FREQ=WEEKLY;INTERVAL=2;COUNT=4;BYDAY=TU,SU;WKST=SU',
+                  datetime.datetime(1997, 8, 5, 9)),
+            [datetime.datetime(1997, 8, day, 9) for day in (5, 17, 19, 31)]
+        )
+
+        # BYSETPOS isn't handled directly, rrulestr parses it
+        bysetpos = 'FREQ=MONTHLY;COUNT=3;BYDAY=MO,TU,WE,TH,FR;BYSETPOS=-1'
+        self.assertIsNone(icalendar._fastRRuleParse(bysetpos, True))
+        self.assertEqual(
+            dates(bysetpos, datetime.datetime(2024, 1, 1, 9)),
+            [datetime.datetime(2024, 1, 31, 9), datetime.datetime(2024, 2, 29, 9),
+             datetime.datetime(2024, 3, 29, 9)]
+        )
 
     def test_recurrence_without_tz(self):
         """
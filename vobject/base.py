@@ -65,6 +65,16 @@ def to_basestring(s):
 
     return s.encode('utf-8')
 
+
+def intern_(s):
+    """Interns a native string, so dictionary lookups compare by identity.
+
+    Python 2 can't intern unicode strings, those are returned unchanged.
+    """
+    if type(s) is str:
+        return six.moves.intern(s)
+    return s
+
 # ------------------------------------ Logging ---------------------------------
 logger = logging.getLogger(__name__)
 if not logging.getLogger().handlers:
@@ -305,7 +315,7 @@ class ContentLine(VBase):
         """
         super(ContentLine, self).__init__(group, *args, **kwds)
 
-        self.name = name.upper()
+        self.name = intern_(name.upper())
         self.encoded = encoded
         self.params = {}
         self.singletonparams = []
@@ -469,7 +479,7 @@ class Component(VBase):
         super(Component, self).__init__(*args, **kwds)
         self.contents = {}
         if name:
-            self.name = name.upper()
+            self.name = intern_(name.upper())
             self.useBegin = True
         else:
             self.name = ''
@@ -608,7 +618,7 @@ class Component(VBase):
             if obj.behavior is None and self.behavior is not None and \
                     isinstance(obj, ContentLine):
                 obj.behavior = self.behavior.defaultBehavior
-        self.contents.setdefault(obj.name.lower(), []).append(obj)
+        self.contents.setdefault(intern_(obj.name.lower()), []).append(obj)
         return obj
 
     def remove(self, obj):
@@ -646,10 +656,11 @@ class Component(VBase):
 
     def sortChildKeys(self):
         try:
-            first = [s for s in self.behavior.sortFirst if s in self.contents]
+            index = self.behavior.sortFirstIndex()
         except Exception:
-            first = []
-        return first + sorted(k for k in self.contents.keys() if k not in first)
+            index = {}
+        last = len(index)
+        return sorted(self.contents, key=lambda k: (index.get(k, last), k))
 
     def getSortedChildren(self):
         return [obj for k in self.sortChildKeys() for obj in self.contents[k]]
@@ -1171,6 +1182,7 @@ def registerBehavior(behavior, name=None, default=False, id=None):
         name = behavior.name.upper()
     if id is None:
         id = behavior.versionString
+    name = intern_(name)
     if name in __behaviorRegistry:
         if default:
             __behaviorRegistry[name].insert(0, (id, behavior))
@@ -1216,5 +1228,16 @@ def newFromBehavior(name, id=None):
 
 # --------------------------- Helper function ----------------------------------
 def backslashEscape(s):
-    s = s.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
-    return s.replace("\r\n", "\\n").replace("\n", "\\n").replace("\r", "\\n")
+    # most values contain none of these, and a substring test is much
+    # cheaper than a replace that finds nothing
+    if "\\" in s:
+        s = s.replace("\\", "\\\\")
+    if ";" in s:
+        s = s.replace(";", "\\;")
+    if "," in s:
+        s = s.replace(",", "\\,")
+    if "\r" in s:
+        s = s.replace("\r\n", "\n").replace("\r", "\n")
+    if "\n" in s:
+        s = s.replace("\n", "\\n")
+    return s
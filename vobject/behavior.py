@@ -168,6 +168,19 @@ class Behavior(object):
             obj.transformToNative()
         return out
 
+    @classmethod
+    def sortFirstIndex(cls):
+        """
+        Return a dictionary mapping each name in sortFirst to its position.
+
+        Computed once per class, sortFirst is treated as immutable.
+        """
+        index = cls.__dict__.get('_sortFirstIndex')
+        if index is None:
+            index = dict((name, i) for i, name in enumerate(cls.sortFirst))
+            cls._sortFirstIndex = index
+        return index
+
     @classmethod
     def valueRepr(cls, line):
         """return the representation of the given content line value"""
@@ -2,11 +2,17 @@
 
 from __future__ import print_function
 
+import binascii
+import calendar
+import collections
+import copy
 import datetime
+import itertools
 import logging
-import random  # for generating a UID
+import os  # for generating a UID
+import re
 import socket
-import string
+import weakref
 import base64
 
 from dateutil import rrule, tz
@@ -43,6 +49,29 @@ PRODID = u"-//PYVOBJECT//NONSGML Version 1//EN"
 WEEKDAYS = "MO", "TU", "WE", "TH", "FR", "SA", "SU"
 FREQUENCIES = ('YEARLY', 'MONTHLY', 'WEEKLY', 'DAILY', 'HOURLY', 'MINUTELY',
                'SECONDLY')
+# str() of the integers RRULE parts like BYYEARDAY or BYSETPOS can hold
+_SMALL_INT_STR = tuple(str(i) for i in range(-60, 400))
+
+# VTIMEZONE subcomponents, in the order transitions are searched for
+PHASES = ('daylight', 'standard')
+# rule values which must match for a transition to continue an existing rule
+RULE_COMPARE_KEYS = ('month', 'weekday', 'hour', 'offset')
+
+# a DST rule found by TimezoneComponent.settzinfo, end is None or the last
+# year the rule was in effect
+TransitionRule = collections.namedtuple(
+    'TransitionRule',
+    'end start month weekday hour plus minus name offset offsetfrom')
+
+
+def _intToString(n):
+    """
+    str(n), looked up in _SMALL_INT_STR for the usual RRULE values.
+    """
+    if -60 <= n < 400:
+        return _SMALL_INT_STR[n + 60]
+    return str(n)
+
 
 zeroDelta = datetime.timedelta(0)
 twoHours = datetime.timedelta(hours=2)
@@ -51,6 +80,15 @@ twoHours = datetime.timedelta(hours=2)
 # ---------------------------- TZID registry -----------------------------------
 __tzidMap = {}
 
+# (id(tzinfo), allowUTC) -> (weakref to tzinfo, tzid), see pickTzid
+_pickTzidCache = {}
+
+# tzids pytz couldn't resolve, so getTzid only tries (and logs) them once.
+# Cleared when it reaches _MAX_UNKNOWN_TZIDS, so a stream of made-up tzids
+# costs some repeated lookups instead of unbounded memory.
+_unknownTzids = set()
+_MAX_UNKNOWN_TZIDS = 1000
+
 
 def toUnicode(s):
     """
@@ -61,33 +99,71 @@ def toUnicode(s):
     return s
 
 
+def _normalizeTzid(tzid):
+    """
+    Strip the leading solidus RFC5545 uses for globally unique TZIDs.
+    """
+    if tzid and tzid.startswith('/'):
+        return tzid[1:]
+    return tzid
+
+
 def registerTzid(tzid, tzinfo):
     """
     Register a tzid -> tzinfo mapping.
     """
-    __tzidMap[toUnicode(tzid)] = tzinfo
+    tzid = toUnicode(tzid)
+    __tzidMap[tzid] = tzinfo
+    _unknownTzids.discard(tzid)
 
 
 def getTzid(tzid, smart=True):
     """
     Return the tzid if it exists, or None.
     """
-    tz = __tzidMap.get(toUnicode(tzid))
-    if smart and tzid and not tz:
+    tzid = toUnicode(tzid)
+    tz = __tzidMap.get(tzid)
+    if not tz and tzid and tzid.startswith('/'):
+        tz = __tzidMap.get(_normalizeTzid(tzid))
+    if smart and tzid and not tz and tzid not in _unknownTzids:
         try:
             from pytz import timezone, UnknownTimeZoneError
             try:
-                tz = timezone(tzid)
-                registerTzid(toUnicode(tzid), tz)
+                tz = timezone(_normalizeTzid(tzid))
+                registerTzid(tzid, tz)
             except UnknownTimeZoneError as e:
                 logging.error(e)
+                _rememberUnknownTzid(tzid)
         except ImportError as e:
             logging.error(e)
+            _rememberUnknownTzid(tzid)
     return tz
 
+
+def _rememberUnknownTzid(tzid):
+    """
+    Add tzid to _unknownTzids, first emptying it if it's full.
+    """
+    if len(_unknownTzids) >= _MAX_UNKNOWN_TZIDS:
+        _unknownTzids.clear()
+    _unknownTzids.add(tzid)
+
 utc = tz.tzutc()
 registerTzid("UTC", utc)
 
+# socket.gethostname() result, looked up once for generated UIDs
+_hostname = None
+
+
+def getHostname():
+    """
+    Return the local host name, caching it after the first call.
+    """
+    global _hostname
+    if _hostname is None:
+        _hostname = socket.gethostname()
+    return _hostname
+
 
 # -------------------- Helper subclasses ---------------------------------------
 class TimezoneComponent(Component):
@@ -104,12 +180,28 @@ class TimezoneComponent(Component):
         A datetime.tzinfo subclass representing this timezone.
     @ivar tzid:
         The string used to refer to this timezone.
+    @ivar yearRange:
+        The (start, end) years searched for transitions when tzinfo is set.
+    @ivar generatedYearRange:
+        The (start, end) years the last tzinfo set covered, or None if this
+        VTIMEZONE wasn't generated from a tzinfo.
     """
+    DEFAULT_YEAR_RANGE = (2000, 2030)
+    yearRange = DEFAULT_YEAR_RANGE
+    # (start, end) years settzinfo last described, None if parsed
+    generatedYearRange = None
+
     def __init__(self, tzinfo=None, *args, **kwds):
         """
         Accept an existing Component or a tzinfo class.
+
+        A yearRange keyword may be given to limit the years represented when
+        converting tzinfo, e.g. to those actually used by a calendar.
         """
+        yearRange = kwds.pop('yearRange', None)
         super(TimezoneComponent, self).__init__(*args, **kwds)
+        if yearRange is not None:
+            self.yearRange = yearRange
         self.isNative = True
         # hack to make sure a behavior is assigned
         if self.behavior is None:
@@ -130,15 +222,27 @@ class TimezoneComponent(Component):
             registerTzid(tzid, tzinfo)
         return tzid
 
+    # (serialized definition, tzinfo tzical parsed from it), serializing is
+    # much cheaper than parsing and catches edits anywhere in the tree
+    _tzinfo_cache = None
+
     def gettzinfo(self):
+        # allow empty VTIMEZONEs
+        if len(self.contents) == 0:
+            return None
+        # a registered tzid wins over this definition everywhere else, so
+        # don't bother parsing it
+        tzid = self.getChildValue('tzid')
+        if tzid:
+            registered = getTzid(tzid, False)
+            if registered is not None:
+                return registered
+
         # workaround for dateutil failing to parse some experimental properties
         good_lines = ('rdate', 'rrule', 'dtstart', 'tzname', 'tzoffsetfrom',
                       'tzoffsetto', 'tzid')
         # serialize encodes as utf-8, cStringIO will leave utf-8 alone
         buffer = six.StringIO()
-        # allow empty VTIMEZONEs
-        if len(self.contents) == 0:
-            return None
 
         def customSerialize(obj):
             if isinstance(obj, Component):
@@ -150,13 +254,22 @@ class TimezoneComponent(Component):
                     customSerialize(comp)
                 foldOneLine(buffer, u"END:" + obj.name)
         customSerialize(self)
+        definition = buffer.getvalue()
+        if self._tzinfo_cache is not None and \
+                self._tzinfo_cache[0] == definition:
+            return self._tzinfo_cache[1]
         buffer.seek(0)  # tzical wants to read a stream
-        return tz.tzical(buffer).get()
+        tzinfo = tz.tzical(buffer).get()
+        self._tzinfo_cache = (definition, tzinfo)
+        return tzinfo
 
-    def settzinfo(self, tzinfo, start=2000, end=2030):
+    def settzinfo(self, tzinfo, start=None, end=None):
         """
         Create appropriate objects in self to represent tzinfo.
 
+        Transitions are searched for from start to end, which default to
+        self.yearRange.
+
         Collapse DST transitions to rrules as much as possible.
 
         Assumptions:
@@ -168,6 +281,11 @@ class TimezoneComponent(Component):
         - tzinfo classes dst method always treats times that could be in either
           offset as being in the later regime
         """
+        if start is None:
+            start = self.yearRange[0]
+        if end is None:
+            end = self.yearRange[1]
+
         def fromLastWeek(dt):
             """
             How many weeks from the end of the month dt is, starting from 1.
@@ -180,157 +298,214 @@ class TimezoneComponent(Component):
                 current += weekDelta
             return n
 
-        # lists of dictionaries defining rules which are no longer in effect
+        # tzinfo lookups are repeated for the same datetimes across phases
+        # and years, and can be expensive (tzical walks its rule list), so
+        # memoize them for the duration of this call
+        _dst, _offsets, _names = {}, {}, {}
+
+        def dst(dt):
+            try:
+                return _dst[dt]
+            except KeyError:
+                return _dst.setdefault(dt, tzinfo.dst(dt))
+
+        def utcoffset(dt):
+            try:
+                return _offsets[dt]
+            except KeyError:
+                return _offsets.setdefault(dt, tzinfo.utcoffset(dt))
+
+        def tzname(dt):
+            try:
+                return _names[dt]
+            except KeyError:
+                return _names.setdefault(dt, tzinfo.tzname(dt))
+
+        # lists of TransitionRules which are no longer in effect
         completed = {'daylight': [], 'standard': []}
 
-        # dictionary defining rules which are currently in effect
+        # TransitionRules which are currently in effect
         working = {'daylight': None, 'standard': None}
 
         # rule may be based on nth week of the month or the nth from the last
         for year in range(start, end + 1):
             newyear = datetime.datetime(year, 1, 1)
-            for transitionTo in 'daylight', 'standard':
-                transition = getTransition(transitionTo, year, tzinfo)
+            for transitionTo in PHASES:
                 oldrule = working[transitionTo]
+                hint = None
+                if oldrule is not None and oldrule.hour is not None:
+                    # the rule in effect usually still holds, check that
+                    # before searching for the transition
+                    if oldrule.plus is not None:
+                        num = oldrule.plus
+                    else:
+                        num = -1 * oldrule.minus
+                    hint = getTransitionOccurrence(
+                        year, oldrule.month, oldrule.weekday, num,
+                        oldrule.hour)
+                transition = getTransition(transitionTo, year, tzinfo, dst,
+                                           hint)
 
                 if transition == newyear:
                     # transitionTo is in effect for the whole year
-                    rule = {'end'        : None,
-                            'start'      : newyear,
-                            'month'      : 1,
-                            'weekday'    : None,
-                            'hour'       : None,
-                            'plus'       : None,
-                            'minus'      : None,
-                            'name'       : tzinfo.tzname(newyear),
-                            'offset'     : tzinfo.utcoffset(newyear),
-                            'offsetfrom' : tzinfo.utcoffset(newyear)}
+                    rule = TransitionRule(end=None,
+                                          start=newyear,
+                                          month=1,
+                                          weekday=None,
+                                          hour=None,
+                                          plus=None,
+                                          minus=None,
+                                          name=tzname(newyear),
+                                          offset=utcoffset(newyear),
+                                          offsetfrom=utcoffset(newyear))
                     if oldrule is None:
                         # transitionTo was not yet in effect
                         working[transitionTo] = rule
                     else:
                         # transitionTo was already in effect
-                        if (oldrule['offset'] != tzinfo.utcoffset(newyear)):
+                        if (oldrule.offset != utcoffset(newyear)):
                             # old rule was different, it shouldn't continue
-                            oldrule['end'] = year - 1
-                            completed[transitionTo].append(oldrule)
+                            completed[transitionTo].append(
+                                oldrule._replace(end=year - 1))
                             working[transitionTo] = rule
                 elif transition is None:
                     # transitionTo is not in effect
                     if oldrule is not None:
                         # transitionTo used to be in effect
-                        oldrule['end'] = year - 1
-                        completed[transitionTo].append(oldrule)
+                        completed[transitionTo].append(
+                            oldrule._replace(end=year - 1))
                         working[transitionTo] = None
                 else:
                     # an offset transition was found
                     try:
-                        old_offset = tzinfo.utcoffset(transition - twoHours)
-                        name = tzinfo.tzname(transition)
-                        offset = tzinfo.utcoffset(transition)
+                        old_offset = utcoffset(transition - twoHours)
+                        name = tzname(transition)
+                        offset = utcoffset(transition)
                     except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError):
                         # guaranteed that tzinfo is a pytz timezone
                         is_dst = (transitionTo == "daylight")
                         old_offset = tzinfo.utcoffset(transition - twoHours, is_dst=is_dst)
                         name = tzinfo.tzname(transition, is_dst=is_dst)
                         offset = tzinfo.utcoffset(transition, is_dst=is_dst)
-                    rule = {'end'     : None,  # None, or an integer year
-                            'start'   : transition,  # the datetime of transition
-                            'month'   : transition.month,
-                            'weekday' : transition.weekday(),
-                            'hour'    : transition.hour,
-                            'name'    : name,
-                            'plus'    : int(
-                                (transition.day - 1)/ 7 + 1),  # nth week of the month
-                            'minus'   : fromLastWeek(transition),  # nth from last week
-                            'offset'  : offset,
-                            'offsetfrom' : old_offset}
+                    rule = TransitionRule(
+                        end=None,  # None, or an integer year
+                        start=transition,  # the datetime of transition
+                        month=transition.month,
+                        weekday=transition.weekday(),
+                        hour=transition.hour,
+                        name=name,
+                        plus=int((transition.day - 1) / 7 + 1),  # nth week of the month
+                        minus=fromLastWeek(transition),  # nth from last week
+                        offset=offset,
+                        offsetfrom=old_offset)
 
                     if oldrule is None:
                         working[transitionTo] = rule
                     else:
-                        plusMatch = rule['plus'] == oldrule['plus']
-                        minusMatch = rule['minus'] == oldrule['minus']
+                        plusMatch = rule.plus == oldrule.plus
+                        minusMatch = rule.minus == oldrule.minus
                         truth = plusMatch or minusMatch
-                        for key in 'month', 'weekday', 'hour', 'offset':
-                            truth = truth and rule[key] == oldrule[key]
+                        for key in RULE_COMPARE_KEYS:
+                            truth = truth and (getattr(rule, key) ==
+                                               getattr(oldrule, key))
                         if truth:
                             # the old rule is still true, limit to plus or minus
                             if not plusMatch:
-                                oldrule['plus'] = None
-                            if not minusMatch:
-                                oldrule['minus'] = None
+                                working[transitionTo] = oldrule._replace(
+                                    plus=None)
+                            elif not minusMatch:
+                                working[transitionTo] = oldrule._replace(
+                                    minus=None)
                         else:
                             # the new rule did not match the old
-                            oldrule['end'] = year - 1
-                            completed[transitionTo].append(oldrule)
+                            completed[transitionTo].append(
+                                oldrule._replace(end=year - 1))
                             working[transitionTo] = rule
 
-        for transitionTo in 'daylight', 'standard':
+        for transitionTo in PHASES:
             if working[transitionTo] is not None:
                 completed[transitionTo].append(working[transitionTo])
 
         self.tzid = []
         self.daylight = []
         self.standard = []
+        self.generatedYearRange = (start, end)
 
         self.add('tzid').value = self.pickTzid(tzinfo, True)
 
-        # old = None # unused?
-        for transitionTo in 'daylight', 'standard':
+        # local names for the helpers used for every rule
+        _deltaToOffset = deltaToOffset
+        _dateTimeToString = dateTimeToString
+        _getTransitionOccurrence = getTransitionOccurrence
+        _WEEKDAYS = WEEKDAYS
+        _utc = utc
+        for transitionTo in PHASES:
             for rule in completed[transitionTo]:
                 comp = self.add(transitionTo)
                 dtstart = comp.add('dtstart')
-                dtstart.value = rule['start']
-                if rule['name'] is not None:
-                    comp.add('tzname').value = rule['name']
+                dtstart.value = rule.start
+                if rule.name is not None:
+                    comp.add('tzname').value = rule.name
                 line = comp.add('tzoffsetto')
-                line.value = deltaToOffset(rule['offset'])
+                line.value = _deltaToOffset(rule.offset)
                 line = comp.add('tzoffsetfrom')
-                line.value = deltaToOffset(rule['offsetfrom'])
+                line.value = _deltaToOffset(rule.offsetfrom)
 
-                if rule['plus'] is not None:
-                    num = rule['plus']
-                elif rule['minus'] is not None:
-                    num = -1 * rule['minus']
+                if rule.plus is not None:
+                    num = rule.plus
+                elif rule.minus is not None:
+                    num = -1 * rule.minus
                 else:
                     num = None
                 if num is not None:
-                    dayString = ";BYDAY=" + str(num) + WEEKDAYS[rule['weekday']]
+                    dayString = ";BYDAY=" + str(num) + _WEEKDAYS[rule.weekday]
                 else:
                     dayString = ""
-                if rule['end'] is not None:
-                    if rule['hour'] is None:
-                        # all year offset, with no rule
-                        endDate = datetime.datetime(rule['end'], 1, 1)
-                    else:
-                        weekday = rrule.weekday(rule['weekday'], num)
-                        du_rule = rrule.rrule(rrule.YEARLY,
-                            bymonth=rule['month'], byweekday=weekday,
-                            dtstart=datetime.datetime(
-                               rule['end'], 1, 1, rule['hour']
-                            )
-                        )
-                        endDate = du_rule[0]
-                    endDate = endDate.replace(tzinfo=utc) - rule['offsetfrom']
-                    endString = ";UNTIL=" + dateTimeToString(endDate)
+                if rule.end is not None:
+                    endDate = _getTransitionOccurrence(
+                        rule.end, rule.month, rule.weekday, num,
+                        rule.hour)
+                    endDate = endDate.replace(tzinfo=_utc) - rule.offsetfrom
+                    endString = ";UNTIL=" + _dateTimeToString(endDate)
                 else:
                     endString = ''
                 new_rule = "FREQ=YEARLY{0!s};BYMONTH={1!s}{2!s}"\
-                    .format(dayString, rule['month'], endString)
+                    .format(dayString, rule.month, endString)
 
                 comp.add('rrule').value = new_rule
 
     tzinfo = property(gettzinfo, settzinfo)
     # prevent Component's __setattr__ from overriding the tzinfo property
-    normal_attributes = Component.normal_attributes + ['tzinfo']
+    normal_attributes = Component.normal_attributes + ['tzinfo',
+                                                       '_tzinfo_cache']
 
     @staticmethod
     def pickTzid(tzinfo, allowUTC=False):
         """
         Given a tzinfo class, use known APIs to determine TZID, or use tzname.
+
+        Results are cached for as long as tzinfo is alive.
         """
-        if tzinfo is None or (not allowUTC and tzinfo_eq(tzinfo, utc)):
+        if tzinfo is None:
+            return None
+        key = (id(tzinfo), allowUTC)
+        cached = _pickTzidCache.get(key)
+        if cached is not None and cached[0]() is tzinfo:
+            return cached[1]
+        tzid = TimezoneComponent._pickTzid(tzinfo, allowUTC)
+        try:
+            ref = weakref.ref(tzinfo,
+                              lambda ref, key=key: _pickTzidCache.pop(key, None))
+        except TypeError:
+            # can't tell when tzinfo goes away, so don't cache it
+            pass
+        else:
+            _pickTzidCache[key] = (ref, tzid)
+        return tzid
+
+    @staticmethod
+    def _pickTzid(tzinfo, allowUTC):
+        if not allowUTC and tzinfo_eq(tzinfo, utc):
             # If tzinfo is UTC, we don't need a TZID
             return None
         # try Pytz's tzid key
@@ -346,10 +521,9 @@ class TimezoneComponent(Component):
             return toUnicode(tzinfo._tzid)
         else:
             # return tzname for standard (non-DST) time
-            notDST = datetime.timedelta(0)
             for month in range(1, 13):
                 dt = datetime.datetime(2000, month, 1)
-                if tzinfo.dst(dt) == notDST:
+                if tzinfo.dst(dt) == zeroDelta:
                     return toUnicode(tzinfo.tzname(dt))
         # there was no standard time in 2000!
         raise VObjectError("Unable to guess TZID for tzinfo {0!s}"
@@ -404,104 +578,57 @@ class RecurringComponent(Component):
         created in these cases, and count isn't updated, so dateutil may list
         a spurious occurrence.
         """
-        rruleset = None
-        for name in DATESANDRULES:
-            addfunc = None
-            for line in self.contents.get(name, ()):
-                # don't bother creating a rruleset unless there's a rule
-                if rruleset is None:
-                    rruleset = rrule.rruleset()
-                if addfunc is None:
-                    addfunc = getattr(rruleset, name)
-
-                try:
-                    dtstart = self.dtstart.value
-                except (AttributeError, KeyError):
-                    # Special for VTODO - try DUE property instead
-                    try:
-                        if self.name == "VTODO":
-                            dtstart = self.due.value
-                        else:
-                            # if there's no dtstart, just return None
-                            logging.error('failed to get dtstart with VTODO')
-                            return None
-                    except (AttributeError, KeyError):
-                        # if there's no due, just return None
-                        logging.error('failed to find DUE at all.')
-                        return None
+        if not any(self.contents.get(name) for name in DATESANDRULES):
+            # don't bother creating a rruleset unless there's a rule
+            return None
 
+        try:
+            dtstart = self.dtstart.value
+        except (AttributeError, KeyError):
+            # Special for VTODO - try DUE property instead
+            try:
+                if self.name == "VTODO":
+                    dtstart = self.due.value
+                else:
+                    # if there's no dtstart, just return None
+                    logging.error('failed to get dtstart with VTODO')
+                    return None
+            except (AttributeError, KeyError):
+                # if there's no due, just return None
+                logging.error('failed to find DUE at all.')
+                return None
+
+        rruleset = rrule.rruleset()
+        for name in DATESANDRULES:
+            lines = self.contents.get(name, ())
+            if not lines:
+                continue
+            addfunc = getattr(rruleset, name)
+            for line in lines:
                 if name in DATENAMES:
-                    if type(line.value[0]) == datetime.datetime:
-                        list(map(addfunc, line.value))
-                    elif type(line.value[0]) == datetime.date:
+                    if isinstance(line.value[0], datetime.datetime):
+                        for dt in line.value:
+                            addfunc(dt)
+                    elif isinstance(line.value[0], datetime.date):
                         for dt in line.value:
                             addfunc(datetime.datetime(dt.year, dt.month, dt.day))
                     else:
                         # ignore RDATEs with PERIOD values for now
                         pass
                 elif name in RULENAMES:
-                    # a Ruby iCalendar library escapes semi-colons in rrules,
-                    # so also remove any backslashes
-                    value = line.value.replace('\\', '')
-                    # If dtstart has no time zone, `until`
-                    # shouldn't get one, either:
-                    ignoretz = (not isinstance(dtstart, datetime.datetime) or
-                                dtstart.tzinfo is None)
-                    try:
-                        until = rrule.rrulestr(value, ignoretz=ignoretz)._until
-                    except ValueError:
-                        # WORKAROUND: dateutil<=2.7.2 doesn't set the time zone
-                        # of dtstart
-                        if ignoretz:
-                            raise
-                        utc_now = datetime.datetime.now(datetime.timezone.utc)
-                        until = rrule.rrulestr(value, dtstart=utc_now)._until
-
-                    if until is not None and isinstance(dtstart,
-                                                        datetime.datetime) and \
-                            (until.tzinfo != dtstart.tzinfo):
-                        # dateutil converts the UNTIL date to a datetime,
-                        # check to see if the UNTIL parameter value was a date
-                        vals = dict(pair.split('=') for pair in
-                                    value.upper().split(';'))
-                        if len(vals.get('UNTIL', '')) == 8:
-                            until = datetime.datetime.combine(until.date(),
-                                                              dtstart.time())
-                        # While RFC2445 says UNTIL MUST be UTC, Chandler allows
-                        # floating recurring events, and uses floating UNTIL
-                        # values. Also, some odd floating UNTIL but timezoned
-                        # DTSTART values have shown up in the wild, so put
-                        # floating UNTIL values DTSTART's timezone
-                        if until.tzinfo is None:
-                            until = until.replace(tzinfo=dtstart.tzinfo)
-
-                        if dtstart.tzinfo is not None:
-                            until = until.astimezone(dtstart.tzinfo)
-
-                        # RFC2445 actually states that UNTIL must be a UTC
-                        # value. Whilst the changes above work OK, one problem
-                        # case is if DTSTART is floating but UNTIL is properly
-                        # specified as UTC (or with a TZID). In that case
-                        # dateutil will fail datetime comparisons. There is no
-                        # easy solution to this as there is no obvious timezone
-                        # (at this point) to do proper floating time offset
-                        # comparisons. The best we can do is treat the UNTIL
-                        # value as floating. This could mean incorrect
-                        # determination of the last instance. The better
-                        # solution here is to encourage clients to use COUNT
-                        # rather than UNTIL when DTSTART is floating.
-                        if dtstart.tzinfo is None:
-                            until = until.replace(tzinfo=None)
-
-                    value_without_until = ';'.join(
-                        pair for pair in value.split(';')
-                        if pair.split('=')[0].upper() != 'UNTIL')
-                    rule = rrule.rrulestr(value_without_until,
-                                          dtstart=dtstart, ignoretz=ignoretz)
-                    rule._until = until
-
-                    # add the rrule or exrule to the rruleset
-                    addfunc(rule)
+                    # parsing is expensive, reuse the rule parsed last time
+                    # if neither the line nor dtstart changed since
+                    cached = getattr(line, '_parsed_rrule', None)
+                    if (cached is not None and cached[0] == line.value and
+                            sameDatetime(cached[1], dtstart)):
+                        rule = cached[2]
+                    else:
+                        rule = rruleFromString(line.value, dtstart)
+                        line._parsed_rrule = (line.value, dtstart, rule)
+
+                    # add a copy of the rrule or exrule to the rruleset, it
+                    # may adjust the count
+                    addfunc(copy.copy(rule))
 
                 if (name == 'rrule' or name == 'rdate') and addRDate:
                     # rlist = rruleset._rrule if name == 'rrule' else rruleset._rdate
@@ -545,7 +672,8 @@ class RecurringComponent(Component):
             else:
                 raise
 
-        isDate = datetime.date == type(dtstart)
+        isDate = (isinstance(dtstart, datetime.date) and
+                  not isinstance(dtstart, datetime.datetime))
         if isDate:
             dtstart = datetime.datetime(dtstart.year, dtstart.month, dtstart.day)
             untilSerialize = dateToString
@@ -567,21 +695,17 @@ class RecurringComponent(Component):
                     self.add(name).value = setlist
             elif name in RULENAMES:
                 for rule in setlist:
-                    buf = six.StringIO()
-                    buf.write('FREQ=')
-                    buf.write(FREQUENCIES[rule._freq])
-
                     values = {}
 
                     if rule._interval != 1:
-                        values['INTERVAL'] = [str(rule._interval)]
+                        values['INTERVAL'] = [_intToString(rule._interval)]
                     if rule._wkst != 0:  # wkst defaults to Monday
                         values['WKST'] = [WEEKDAYS[rule._wkst]]
                     if rule._bysetpos is not None:
-                        values['BYSETPOS'] = [str(i) for i in rule._bysetpos]
+                        values['BYSETPOS'] = [_intToString(i) for i in rule._bysetpos]
 
                     if rule._count is not None:
-                        values['COUNT'] = [str(rule._count)]
+                        values['COUNT'] = [_intToString(rule._count)]
                     elif rule._until is not None:
                         values['UNTIL'] = [untilSerialize(rule._until)]
 
@@ -595,7 +719,8 @@ class RecurringComponent(Component):
                         days.extend(WEEKDAYS[n] for n in rule._byweekday)
 
                     if rule._bynweekday is not None:
-                        days.extend(n + WEEKDAYS[day] for day, n in rule._bynweekday)
+                        days.extend(_intToString(n) + WEEKDAYS[day]
+                                    for day, n in rule._bynweekday)
 
                     if len(days) > 0:
                         values['BYDAY'] = days
@@ -606,10 +731,11 @@ class RecurringComponent(Component):
                                  len(rule._bymonthday) == 1 and
                                  rule._bymonthday[0] == rule._dtstart.day)):
                         # ignore bymonthday if it's generated by dateutil
-                        values['BYMONTHDAY'] = [str(n) for n in rule._bymonthday]
+                        values['BYMONTHDAY'] = [_intToString(n) for n in rule._bymonthday]
 
                     if rule._bynmonthday is not None and len(rule._bynmonthday) > 0:
-                        values.setdefault('BYMONTHDAY', []).extend(str(n) for n in rule._bynmonthday)
+                        values.setdefault('BYMONTHDAY', []).extend(
+                            _intToString(n) for n in rule._bynmonthday)
 
                     if (rule._bymonth is not None and
                             len(rule._bymonth) > 0 and
@@ -619,22 +745,20 @@ class RecurringComponent(Component):
                                   len(rule._bymonth) == 1 and
                                   rule._bymonth[0] == rule._dtstart.month))):
                         # ignore bymonth if it's generated by dateutil
-                        values['BYMONTH'] = [str(n) for n in rule._bymonth]
+                        values['BYMONTH'] = [_intToString(n) for n in rule._bymonth]
 
                     if rule._byyearday is not None:
-                        values['BYYEARDAY'] = [str(n) for n in rule._byyearday]
+                        values['BYYEARDAY'] = [_intToString(n) for n in rule._byyearday]
                     if rule._byweekno is not None:
-                        values['BYWEEKNO'] = [str(n) for n in rule._byweekno]
+                        values['BYWEEKNO'] = [_intToString(n) for n in rule._byweekno]
 
                     # byhour, byminute, bysecond are always ignored for now
 
+                    parts = ['FREQ=' + FREQUENCIES[rule._freq]]
                     for key, paramvals in values.items():
-                        buf.write(';')
-                        buf.write(key)
-                        buf.write('=')
-                        buf.write(','.join(paramvals))
+                        parts.append(key + '=' + ','.join(paramvals))
 
-                    self.add(name).value = buf.getvalue()
+                    self.add(name).value = ';'.join(parts)
 
     rruleset = property(getrruleset, setrruleset)
 
@@ -678,7 +802,7 @@ class TextBehavior(behavior.Behavior):
         if not line.encoded:
             encoding = getattr(line, 'encoding_param', None)
             if encoding and encoding.upper() == cls.base64string:
-                line.value = base64.b64encode(line.value.encode('utf-8')).decode('utf-8').replace('\n', '')
+                line.value = base64.b64encode(line.value.encode('utf-8')).decode('utf-8')
             else:
                 line.value = backslashEscape(line.value)
             line.encoded = True
@@ -720,10 +844,10 @@ class RecurringBehavior(VCalendarComponentBehavior):
         This is just a dummy implementation, for now.
         """
         if not hasattr(obj, 'uid'):
-            rand = int(random.random() * 100000)
+            rand = binascii.hexlify(os.urandom(4)).decode('ascii')
             now = datetime.datetime.now(utc)
             now = dateTimeToString(now)
-            host = socket.gethostname()
+            host = getHostname()
             obj.add(ContentLine('UID', [], "{0} - {1}@{2}".format(now, rand,
                                                                   host)))
 
@@ -771,7 +895,12 @@ class DateTimeBehavior(behavior.Behavior):
         """
         if obj.isNative:
             obj.isNative = False
-            tzid = TimezoneComponent.registerTzinfo(obj.value.tzinfo)
+            tzinfo = obj.value.tzinfo
+            if tzinfo is None or tzinfo is utc:
+                # floating and UTC times never need a TZID
+                tzid = None
+            else:
+                tzid = TimezoneComponent.registerTzinfo(tzinfo)
             obj.value = dateTimeToString(obj.value, cls.forceUTC)
             if not cls.forceUTC and tzid is not None:
                 obj.tzid_param = tzid
@@ -808,11 +937,11 @@ class DateOrDateTimeBehavior(behavior.Behavior):
             return obj
         obj.value = obj.value
         obj.value = parseDtstart(obj, allowSignatureMismatch=True)
-        if (getattr(obj, 'value_param', 'DATE-TIME').upper() == 'DATE-TIME' and
-                hasattr(obj, 'tzid_param')):
+        params = obj.params
+        if ('TZID' in params and
+                params.get('VALUE', ('DATE-TIME',))[0].upper() == 'DATE-TIME'):
             # Keep a copy of the original TZID around
-            obj.params['X-VOBJ-ORIGINAL-TZID'] = [obj.tzid_param]
-            del obj.tzid_param
+            params['X-VOBJ-ORIGINAL-TZID'] = [params.pop('TZID')[0]]
         return obj
 
     @staticmethod
@@ -820,7 +949,8 @@ class DateOrDateTimeBehavior(behavior.Behavior):
         """
         Replace the date or datetime in obj.value with an ISO 8601 string.
         """
-        if type(obj.value) == datetime.date:
+        if (isinstance(obj.value, datetime.date) and
+                not isinstance(obj.value, datetime.datetime)):
             obj.isNative = False
             obj.value_param = 'DATE'
             obj.value = dateToString(obj.value)
@@ -848,15 +978,19 @@ class MultiDateBehavior(behavior.Behavior):
         if obj.value == '':
             obj.value = []
             return obj
-        tzinfo = getTzid(getattr(obj, 'tzid_param', None))
-        valueParam = getattr(obj, 'value_param', "DATE-TIME").upper()
+        params = obj.params
+        tzinfo = getTzid(params.get('TZID', (None,))[0])
+        valueParam = params.get('VALUE', ('DATE-TIME',))[0].upper()
         valTexts = obj.value.split(",")
+        # map the parsers directly, RDATEs can have a great many values
         if valueParam == "DATE":
-            obj.value = [stringToDate(x) for x in valTexts]
+            obj.value = list(map(stringToDate, valTexts))
         elif valueParam == "DATE-TIME":
-            obj.value = [stringToDateTime(x, tzinfo) for x in valTexts]
+            obj.value = list(map(stringToDateTime, valTexts,
+                                 itertools.repeat(tzinfo)))
         elif valueParam == "PERIOD":
-            obj.value = [stringToPeriod(x, tzinfo) for x in valTexts]
+            obj.value = list(map(stringToPeriod, valTexts,
+                                 itertools.repeat(tzinfo)))
         return obj
 
     @staticmethod
@@ -865,7 +999,8 @@ class MultiDateBehavior(behavior.Behavior):
         Replace the date, datetime or period tuples in obj.value with
         appropriate strings.
         """
-        if obj.value and type(obj.value[0]) == datetime.date:
+        if (obj.value and isinstance(obj.value[0], datetime.date) and
+                not isinstance(obj.value[0], datetime.datetime)):
             obj.isNative = False
             obj.value_param = 'DATE'
             obj.value = ','.join([dateToString(val) for val in obj.value])
@@ -877,7 +1012,7 @@ class MultiDateBehavior(behavior.Behavior):
                 transformed = []
                 tzid = None
                 for val in obj.value:
-                    if tzid is None and type(val) == datetime.datetime:
+                    if tzid is None and isinstance(val, datetime.datetime):
                         tzid = TimezoneComponent.registerTzinfo(val.tzinfo)
                         if tzid is not None:
                             obj.tzid_param = tzid
@@ -910,8 +1045,8 @@ class MultiTextBehavior(behavior.Behavior):
         Backslash escape line.value.
         """
         if not line.encoded:
-            line.value = cls.listSeparator.join(backslashEscape(val)
-                                                for val in line.value)
+            line.value = cls.listSeparator.join([backslashEscape(val)
+                                                 for val in line.value])
             line.encoded = True
 
 
@@ -956,35 +1091,75 @@ class VCalendar2_0(VCalendarComponentBehavior):
             obj.add(ContentLine('PRODID', [], PRODID))
         if not hasattr(obj, 'version'):
             obj.add(ContentLine('VERSION', [], cls.versionString))
-        tzidsUsed = {}
+        tzidsUsed = set()
+        # tzid -> earliest year it's used in, or None if unknown
+        firstYears = {}
+        # id(tzinfo) -> tzid, so each tzinfo is only registered once
+        tzidCache = {}
+
+        def noteYear(tzid, value):
+            year = getattr(value, 'year', None)
+            if year is None or firstYears.get(tzid, year) is None:
+                firstYears[tzid] = None
+            else:
+                firstYears[tzid] = min(firstYears.get(tzid, year), year)
+
+        def lookupTzid(tzinfo):
+            if tzinfo is None:
+                return None
+            key = id(tzinfo)
+            if key not in tzidCache:
+                tzidCache[key] = TimezoneComponent.registerTzinfo(tzinfo)
+            return tzidCache[key]
 
         def findTzids(obj, table):
             if isinstance(obj, ContentLine) and (obj.behavior is None or
                                                  not obj.behavior.forceUTC):
-                if getattr(obj, 'tzid_param', None):
-                    table[obj.tzid_param] = 1
+                tzid = getattr(obj, 'tzid_param', None)
+                if tzid:
+                    table.add(tzid)
+                    noteYear(tzid, None)
                 else:
-                    if type(obj.value) == list:
+                    if isinstance(obj.value, list):
                         for item in obj.value:
-                            tzinfo = getattr(obj.value, 'tzinfo', None)
-                            tzid = TimezoneComponent.registerTzinfo(tzinfo)
+                            tzid = lookupTzid(getattr(item, 'tzinfo', None))
                             if tzid:
-                                table[tzid] = 1
+                                table.add(tzid)
+                                noteYear(tzid, item)
                     else:
-                        tzinfo = getattr(obj.value, 'tzinfo', None)
-                        tzid = TimezoneComponent.registerTzinfo(tzinfo)
+                        tzid = lookupTzid(getattr(obj.value, 'tzinfo', None))
                         if tzid:
-                            table[tzid] = 1
+                            table.add(tzid)
+                            noteYear(tzid, obj.value)
+            if obj.name == 'VTIMEZONE':
+                return
             for child in obj.getChildren():
-                if obj.name != 'VTIMEZONE':
-                    findTzids(child, table)
+                findTzids(child, table)
 
         findTzids(obj, tzidsUsed)
-        oldtzids = [toUnicode(x.tzid.value) for x in getattr(obj, 'vtimezone_list', [])]
-        for tzid in tzidsUsed.keys():
+        oldtzids = dict((toUnicode(x.tzid.value), x)
+                        for x in getattr(obj, 'vtimezone_list', []))
+        for tzid in sorted(tzidsUsed):
             tzid = toUnicode(tzid)
-            if tzid != u'UTC' and tzid not in oldtzids:
-                obj.add(TimezoneComponent(tzinfo=getTzid(tzid)))
+            if tzid == u'UTC':
+                continue
+            # no need to describe years before anything using this tzid,
+            # apart from the one before it, which may set the offset in
+            # effect at its start
+            start, end = TimezoneComponent.DEFAULT_YEAR_RANGE
+            firstYear = firstYears.get(tzid)
+            if firstYear is not None:
+                start = min(max(start, firstYear - 1), end)
+            old = oldtzids.get(tzid)
+            if old is None:
+                obj.add(TimezoneComponent(tzinfo=getTzid(tzid),
+                                          yearRange=(start, end)))
+            elif old.generatedYearRange is not None:
+                # a VTIMEZONE generated by an earlier serialize may have been
+                # narrowed to years that no longer cover everything using it
+                oldStart, oldEnd = old.generatedYearRange
+                if start < oldStart:
+                    old.settzinfo(getTzid(tzid), start, oldEnd)
 
     @classmethod
     def serialize(cls, obj, buf, lineLength, validate=True):
@@ -1017,21 +1192,20 @@ class VCalendar2_0(VCalendarComponentBehavior):
             foldOneLine(outbuf, "{0}BEGIN:{1}".format(groupString, obj.name),
                         lineLength)
 
-        try:
-            first_props = [s for s in cls.sortFirst if s in obj.contents \
-                                    and not isinstance(obj.contents[s][0], Component)]
-            first_components = [s for s in cls.sortFirst if s in obj.contents \
-                                    and isinstance(obj.contents[s][0], Component)]
-        except Exception:
-            first_props = first_components = []
-            # first_components = []
-
-        prop_keys = sorted(list(k for k in obj.contents.keys() if k not in first_props \
-                                         and not isinstance(obj.contents[k][0], Component)))
-        comp_keys = sorted(list(k for k in obj.contents.keys() if k not in first_components \
-                                        and isinstance(obj.contents[k][0], Component)))
-
-        sorted_keys = first_props + prop_keys + first_components + comp_keys
+        index = cls.sortFirstIndex()
+        last = len(index)
+
+        def sortKey(k):
+            return (index.get(k, last), k)
+
+        prop_keys = sorted((k for k in obj.contents
+                            if not isinstance(obj.contents[k][0], Component)),
+                           key=sortKey)
+        comp_keys = sorted((k for k in obj.contents
+                            if isinstance(obj.contents[k][0], Component)),
+                           key=sortKey)
+
+        sorted_keys = prop_keys + comp_keys
         children = [o for k in sorted_keys for o in obj.contents[k]]
 
         for child in children:
@@ -1326,7 +1500,7 @@ class VAlarm(VCalendarComponentBehavior):
     def validate(cls, obj, raiseException, *args):
         """
         # TODO
-        if obj.contents.has_key('dtend') and obj.contents.has_key('duration'):
+        if 'dtend' in obj.contents and 'duration' in obj.contents:
             if raiseException:
                 m = "VEVENT components cannot contain both DTEND and DURATION\
                      components"
@@ -1443,17 +1617,14 @@ class Duration(behavior.Behavior):
         if obj.isNative:
             return obj
         obj.isNative = True
-        obj.value = obj.value
-        if obj.value == '':
+        if obj.value == '' or isinstance(obj.value, datetime.timedelta):
             return obj
+        # When can DURATION have multiple durations?  For now:
+        elif ',' in obj.value:
+            raise ParseError("DURATION must have a single duration string.")
         else:
-            deltalist = stringToDurations(obj.value)
-            # When can DURATION have multiple durations?  For now:
-            if len(deltalist) == 1:
-                obj.value = deltalist[0]
-                return obj
-            else:
-                raise ParseError("DURATION must have a single duration string.")
+            obj.value = _parseSingleDuration(obj.value)
+            return obj
 
     @staticmethod
     def transformFromNative(obj):
@@ -1485,9 +1656,7 @@ class Trigger(behavior.Behavior):
         """
         if obj.isNative:
             return obj
-        value = getattr(obj, 'value_param', 'DURATION').upper()
-        if hasattr(obj, 'value_param'):
-            del obj.value_param
+        value = obj.params.pop('VALUE', ('DURATION',))[0].upper()
         if obj.value == '':
             obj.isNative = True
             return obj
@@ -1515,10 +1684,10 @@ class Trigger(behavior.Behavior):
 
     @staticmethod
     def transformFromNative(obj):
-        if type(obj.value) == datetime.datetime:
+        if isinstance(obj.value, datetime.datetime):
             obj.value_param = 'DATE-TIME'
             return UTCDateTimeBehavior.transformFromNative(obj)
-        elif type(obj.value) == datetime.timedelta:
+        elif isinstance(obj.value, datetime.timedelta):
             return Duration.transformFromNative(obj)
         else:
             raise NativeError("Native TRIGGER values must be timedelta or "
@@ -1543,7 +1712,7 @@ class PeriodBehavior(behavior.Behavior):
         if obj.value == '':
             obj.value = []
             return obj
-        tzinfo = getTzid(getattr(obj, 'tzid_param', None))
+        tzinfo = getTzid(obj.params.get('TZID', (None,))[0])
         obj.value = [stringToPeriod(x, tzinfo) for x in obj.value.split(",")]
         return obj
 
@@ -1587,11 +1756,12 @@ registerBehavior(RRule, 'EXRULE')
 
 # ------------------------ Registration of common classes ----------------------
 utcDateTimeList = ['LAST-MODIFIED', 'CREATED', 'COMPLETED', 'DTSTAMP']
-list(map(lambda x: registerBehavior(UTCDateTimeBehavior, x), utcDateTimeList))
+for _name in utcDateTimeList:
+    registerBehavior(UTCDateTimeBehavior, _name)
 
 dateTimeOrDateList = ['DTEND', 'DTSTART', 'DUE', 'RECURRENCE-ID']
-list(map(lambda x: registerBehavior(DateOrDateTimeBehavior, x),
-         dateTimeOrDateList))
+for _name in dateTimeOrDateList:
+    registerBehavior(DateOrDateTimeBehavior, _name)
 
 registerBehavior(MultiDateBehavior, 'RDATE')
 registerBehavior(MultiDateBehavior, 'EXDATE')
@@ -1600,10 +1770,11 @@ registerBehavior(MultiDateBehavior, 'EXDATE')
 textList = ['CALSCALE', 'METHOD', 'PRODID', 'CLASS', 'COMMENT', 'DESCRIPTION',
             'LOCATION', 'STATUS', 'SUMMARY', 'TRANSP', 'CONTACT', 'RELATED-TO',
             'UID', 'ACTION', 'BUSYTYPE']
-list(map(lambda x: registerBehavior(TextBehavior, x), textList))
+for _name in textList:
+    registerBehavior(TextBehavior, _name)
 
-list(map(lambda x: registerBehavior(MultiTextBehavior, x), ['CATEGORIES',
-                                                            'RESOURCES']))
+for _name in ('CATEGORIES', 'RESOURCES'):
+    registerBehavior(MultiTextBehavior, _name)
 registerBehavior(SemicolonMultiTextBehavior, 'REQUEST-STATUS')
 
 
@@ -1612,28 +1783,21 @@ def numToDigits(num, places):
     """
     Helper, for converting numbers to textual digits.
     """
-    s = str(num)
-    if len(s) < places:
-        return ("0" * (places - len(s))) + s
-    elif len(s) > places:
+    s = "%0*d" % (places, num)
+    if len(s) > places:
         return s[-places:]
-    else:
-        return s
+    return s
 
 
 def timedeltaToString(delta):
     """
     Convert timedelta to an ical DURATION.
     """
-    if delta.days == 0:
-        sign = 1
-    else:
-        sign = delta.days / abs(delta.days)
+    sign = -1 if delta.days < 0 else 1
     delta = abs(delta)
     days = delta.days
-    hours = int(delta.seconds / 3600)
-    minutes = int((delta.seconds % 3600) / 60)
-    seconds = int(delta.seconds % 60)
+    minutes, seconds = divmod(delta.seconds, 60)
+    hours, minutes = divmod(minutes, 60)
 
     output = ''
     if sign == -1:
@@ -1665,28 +1829,26 @@ def timeToString(dateOrDateTime):
 
 
 def dateToString(date):
-    year = numToDigits(date.year,  4)
-    month = numToDigits(date.month, 2)
-    day = numToDigits(date.day,   2)
-    return year + month + day
+    return "%04d%02d%02d" % (date.year, date.month, date.day)
 
 
 def dateTimeToString(dateTime, convertToUTC=False):
     """
     Ignore tzinfo unless convertToUTC.  Output string.
     """
-    if dateTime.tzinfo and convertToUTC:
+    tzinfo = dateTime.tzinfo
+    if tzinfo is not None and convertToUTC and tzinfo is not utc:
         dateTime = dateTime.astimezone(utc)
-
-    datestr = "{0}{1}{2}T{3}{4}{5}".format(
-        numToDigits(dateTime.year, 4),
-        numToDigits(dateTime.month, 2),
-        numToDigits(dateTime.day, 2),
-        numToDigits(dateTime.hour, 2),
-        numToDigits(dateTime.minute, 2),
-        numToDigits(dateTime.second, 2),
-    )
-    if tzinfo_eq(dateTime.tzinfo, utc):
+        tzinfo = utc
+
+    datestr = "%04d%02d%02dT%02d%02d%02d" % (
+        dateTime.year, dateTime.month, dateTime.day,
+        dateTime.hour, dateTime.minute, dateTime.second)
+    # only a zone at UTC's offset right now can be equivalent to UTC, so
+    # skip tzinfo_eq's search through the years for everything else
+    if tzinfo is utc or (tzinfo is not None and
+                         tzinfo.utcoffset(dateTime) == zeroDelta and
+                         tzinfo_eq(tzinfo, utc)):
         datestr += "Z"
     return datestr
 
@@ -1715,8 +1877,7 @@ def periodToString(period, convertToUTC=False):
 
 # ----------------------- Parsing functions ------------------------------------
 def isDuration(s):
-    s = s.upper()
-    return (s.find("P") != -1) and (s.find("P") < 2)
+    return 'P' in s[:2].upper()
 
 
 def stringToDate(s):
@@ -1726,6 +1887,12 @@ def stringToDate(s):
     return datetime.date(year, month, day)
 
 
+# anything may separate the date from the time, and anything after the
+# seconds (or the Z following them) is ignored
+_dateTimeRe = re.compile(r'(\d{4})(\d{2})(\d{2}).(\d{2})(\d{2})(\d{2})(Z?)',
+                         re.DOTALL)
+
+
 def stringToDateTime(s, tzinfo=None, strict=False):
     """
     Returns datetime.datetime object.
@@ -1733,17 +1900,14 @@ def stringToDateTime(s, tzinfo=None, strict=False):
     if not strict:
         s = s.strip()
 
-    try:
-        year = int(s[0:4])
-        month = int(s[4:6])
-        day = int(s[6:8])
-        hour = int(s[9:11])
-        minute = int(s[11:13])
-        second = int(s[13:15])
-        if len(s) > 15 and s[15] == 'Z':
-            tzinfo = getTzid('UTC')
-    except:
+    match = _dateTimeRe.match(s)
+    if match is None:
         raise ParseError("'{0!s}' is not a valid DATE-TIME".format(s))
+    year, month, day, hour, minute, second, z = match.groups()
+    if z:
+        tzinfo = getTzid('UTC')
+    year, month, day = int(year), int(month), int(day)
+    hour, minute, second = int(hour), int(minute), int(second)
     year = year and year or 2000
     if tzinfo is not None and hasattr(tzinfo,'localize'):  # PyTZ case
         return tzinfo.localize(datetime.datetime(year, month, day, hour, minute, second))
@@ -1755,6 +1919,20 @@ def stringToDateTime(s, tzinfo=None, strict=False):
 escapableCharList = '\\;,Nn"'
 
 
+# listSeparator -> compiled regex matching an escape, a separator, or a run of
+# ordinary characters, see stringToTextValues
+_textTokenRes = {}
+
+
+def _textTokenRe(listSeparator):
+    regex = _textTokenRes.get(listSeparator)
+    if regex is None:
+        sep = re.escape(listSeparator)
+        regex = re.compile(r'\\(.?)|({0})|[^\\{0}]+'.format(sep), re.DOTALL)
+        _textTokenRes[listSeparator] = regex
+    return regex
+
+
 def stringToTextValues(s, listSeparator=',', charList=None, strict=False):
     """
     Returns list of strings.
@@ -1762,186 +1940,56 @@ def stringToTextValues(s, listSeparator=',', charList=None, strict=False):
     if charList is None:
         charList = escapableCharList
 
-    def escapableChar(c):
-        return c in charList
+    current = []
+    results = []
 
-    def error(msg):
-        if strict:
-            raise ParseError(msg)
+    for match in _textTokenRe(listSeparator).finditer(s):
+        escaped, separator = match.group(1, 2)
+        if separator is not None:
+            results.append("".join(current))
+            current = []
+        elif escaped is None:
+            current.append(match.group(0))
+        elif escaped and escaped in charList:
+            current.append('\n' if escaped in 'nN' else escaped)
         else:
-            logging.error(msg)
+            # leave unrecognized escaped characters for later passes
+            current.append('\\' + escaped)
 
-    # vars which control state machine
-    charIterator = enumerate(s)
-    state = "read normal"
+    if len(current) or len(results) == 0:
+        results.append("".join(current))
+    return results
 
-    current = []
-    results = []
 
-    while True:
-        try:
-            charIndex, char = next(charIterator)
-        except:
-            char = "eof"
-
-        if state == "read normal":
-            if char == '\\':
-                state = "read escaped char"
-            elif char == listSeparator:
-                state = "read normal"
-                current = "".join(current)
-                results.append(current)
-                current = []
-            elif char == "eof":
-                state = "end"
-            else:
-                state = "read normal"
-                current.append(char)
-
-        elif state == "read escaped char":
-            if escapableChar(char):
-                state = "read normal"
-                if char in 'nN':
-                    current.append('\n')
-                else:
-                    current.append(char)
-            else:
-                state = "read normal"
-                # leave unrecognized escaped characters for later passes
-                current.append('\\' + char)
+_durationRe = re.compile(r"""
+    ([-+]?)P?
+    (?:(\d+)W)?
+    (?:(\d+)D)?
+    T?
+    (?:(\d+)H)?
+    (?:(\d+)M)?
+    (?:(\d+)S)?$""", re.IGNORECASE | re.VERBOSE)
 
-        elif state == "end":  # an end state
-            if len(current) or len(results) == 0:
-                current = "".join(current)
-                results.append(current)
-            return results
 
-        elif state == "error":  # an end state
-            return results
-
-        else:
-            state = "error"
-            error("unknown state: '{0!s}' reached in {1!s}".format(state, s))
+def _parseSingleDuration(s):
+    """
+    Returns a timedelta for a single duration string.
+    """
+    match = _durationRe.match(s.strip())
+    if match is None or not any(match.group(2, 3, 4, 5, 6)):
+        raise ParseError("invalid duration: " + s)
+    sign, week, day, hour, minute, sec = match.groups()
+    delta = datetime.timedelta(weeks=int(week or 0), days=int(day or 0),
+                               hours=int(hour or 0), minutes=int(minute or 0),
+                               seconds=int(sec or 0))
+    return -delta if sign == '-' else delta
 
 
 def stringToDurations(s, strict=False):
     """
     Returns list of timedelta objects.
     """
-    def makeTimedelta(sign, week, day, hour, minute, sec):
-        if sign == "-":
-            sign = -1
-        else:
-            sign = 1
-        week = int(week)
-        day = int(day)
-        hour = int(hour)
-        minute = int(minute)
-        sec = int(sec)
-        return sign * datetime.timedelta(weeks=week, days=day, hours=hour,
-                                         minutes=minute, seconds=sec)
-
-    def error(msg):
-        if strict:
-            raise ParseError(msg)
-        else:
-            raise ParseError(msg)
-
-    # vars which control state machine
-    charIterator = enumerate(s)
-    state = "start"
-
-    durations = []
-    current = ""
-    sign = None
-    week = 0
-    day = 0
-    hour = 0
-    minute = 0
-    sec = 0
-
-    while True:
-        try:
-            charIndex, char = next(charIterator)
-        except:
-            char = "eof"
-
-        if state == "start":
-            if char == '+':
-                state = "start"
-                sign = char
-            elif char == '-':
-                state = "start"
-                sign = char
-            elif char.upper() == 'P':
-                state = "read field"
-            elif char == "eof":
-                state = "error"
-                error("got end-of-line while reading in duration: " + s)
-            elif char in string.digits:
-                state = "read field"
-                current = current + char  # update this part when updating "read field"
-            else:
-                state = "error"
-                error("got unexpected character {0} reading in duration: {1}"
-                      .format(char, s))
-
-        elif state == "read field":
-            if (char in string.digits):
-                state = "read field"
-                current = current + char  # update part above when updating "read field"
-            elif char.upper() == 'T':
-                state = "read field"
-            elif char.upper() == 'W':
-                state = "read field"
-                week = current
-                current = ""
-            elif char.upper() == 'D':
-                state = "read field"
-                day = current
-                current = ""
-            elif char.upper() == 'H':
-                state = "read field"
-                hour = current
-                current = ""
-            elif char.upper() == 'M':
-                state = "read field"
-                minute = current
-                current = ""
-            elif char.upper() == 'S':
-                state = "read field"
-                sec = current
-                current = ""
-            elif char == ",":
-                state = "start"
-                durations.append(makeTimedelta(sign, week, day, hour, minute,
-                                               sec))
-                current = ""
-                sign = None
-                week = None
-                day = None
-                hour = None
-                minute = None
-                sec = None
-            elif char == "eof":
-                state = "end"
-            else:
-                state = "error"
-                error("got unexpected character reading in duration: " + s)
-
-        elif state == "end":  # an end state
-            if (sign or week or day or hour or minute or sec):
-                durations.append(makeTimedelta(sign, week, day, hour, minute,
-                                               sec))
-            return durations
-
-        elif state == "error":  # an end state
-            error("in error state")
-            return durations
-
-        else:
-            state = "error"
-            error("unknown state: '{0!s}' reached in {1!s}".format(state, s))
+    return [_parseSingleDuration(chunk) for chunk in s.split(',')]
 
 
 def parseDtstart(contentline, allowSignatureMismatch=False):
@@ -1952,8 +2000,9 @@ def parseDtstart(contentline, allowSignatureMismatch=False):
     parameter, so rather than failing on these (technically invalid) lines,
     if allowSignatureMismatch is True, try to parse both varieties.
     """
-    tzinfo = getTzid(getattr(contentline, 'tzid_param', None))
-    valueParam = getattr(contentline, 'value_param', 'DATE-TIME').upper()
+    params = contentline.params
+    tzinfo = getTzid(params.get('TZID', (None,))[0])
+    valueParam = params.get('VALUE', ('DATE-TIME',))[0].upper()
     if valueParam == "DATE":
         return stringToDate(contentline.value)
     elif valueParam == "DATE-TIME":
@@ -1977,48 +2026,207 @@ def stringToPeriod(s, tzinfo=None):
         return (start, stringToDateTime(valEnd, tzinfo))
 
 
-def getTransition(transitionTo, year, tzinfo):
+_rruleUntilRe = re.compile(
+    r'(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})(Z?))?$')
+_rruleIntListKeys = {'BYMONTH': 'bymonth', 'BYMONTHDAY': 'bymonthday'}
+
+
+def _fastRRuleParse(value, ignoretz):
     """
-    Return the datetime of the transition to/from DST, or None.
+    Tokenize the common FREQ/INTERVAL/COUNT/UNTIL/BYDAY subset of an RRULE.
+
+    Returns (kwargs, until) for dateutil's rrule constructor, or None if value
+    uses anything else, in which case it should be left to rrulestr.
     """
-    def firstTransition(iterDates, test):
-        """
-        Return the last date not matching test, or None if all tests matched.
-        """
-        success = None
-        for dt in iterDates:
-            if not test(dt):
-                success = dt
+    kwargs = {}
+    until = None
+    try:
+        for pair in value.upper().split(';'):
+            name, sep, val = pair.partition('=')
+            if not sep or val != val.strip():
+                return None
+            if name == 'FREQ':
+                kwargs['freq'] = FREQUENCIES.index(val)
+            elif name == 'INTERVAL' or name == 'COUNT':
+                kwargs[name.lower()] = int(val)
+            elif name == 'UNTIL':
+                match = _rruleUntilRe.match(val)
+                if match is None:
+                    return None
+                year, month, day, hour, minute, second, z = match.groups()
+                until = datetime.datetime(int(year), int(month), int(day),
+                                          int(hour or 0), int(minute or 0),
+                                          int(second or 0))
+                if z and not ignoretz:
+                    until = until.replace(tzinfo=utc)
+            elif name == 'BYDAY':
+                days = []
+                for day in val.split(','):
+                    n = day[:-2]
+                    weekday = rrule.weekdays[WEEKDAYS.index(day[-2:])]
+                    days.append(weekday(int(n)) if n else weekday)
+                kwargs['byweekday'] = days
+            elif name in _rruleIntListKeys:
+                kwargs[_rruleIntListKeys[name]] = [int(n) for n in
+                                                   val.split(',')]
+            elif name == 'WKST':
+                kwargs['wkst'] = WEEKDAYS.index(val)
             else:
-                if success is not None:
-                    return success
-        return success  # may be None
+                return None
+    except ValueError:
+        return None
+    if 'freq' not in kwargs:
+        return None
+    return kwargs, until
 
-    def generateDates(year, month=None, day=None):
-        """
-        Iterate over possible dates with unspecified values.
-        """
-        months = range(1, 13)
-        days = range(1, 32)
-        hours = range(0, 24)
-        if month is None:
-            for month in months:
-                yield datetime.datetime(year, month, 1)
-        elif day is None:
-            for day in days:
-                try:
-                    yield datetime.datetime(year, month, day)
-                except ValueError:
-                    pass
+
+def rruleFromString(value, dtstart):
+    """
+    Parse an RRULE or EXRULE value into a dateutil rrule starting at dtstart.
+    """
+    # If dtstart has no time zone, `until` shouldn't get one, either
+    ignoretz = (not isinstance(dtstart, datetime.datetime) or
+                dtstart.tzinfo is None)
+    # a Ruby iCalendar library escapes semi-colons in rrules,
+    # so also remove any backslashes
+    value = value.replace('\\', '')
+    parsed = _fastRRuleParse(value, ignoretz)
+    if parsed is not None:
+        kwargs, until = parsed
+    else:
+        try:
+            until = rrule.rrulestr(value, ignoretz=ignoretz)._until
+        except ValueError:
+            # WORKAROUND: dateutil<=2.7.2 doesn't set the time zone
+            # of dtstart
+            if ignoretz:
+                raise
+            utc_now = datetime.datetime.now(datetime.timezone.utc)
+            until = rrule.rrulestr(value, dtstart=utc_now)._until
+
+    if until is not None and isinstance(dtstart,
+                                        datetime.datetime) and \
+            (until.tzinfo != dtstart.tzinfo):
+        # dateutil converts the UNTIL date to a datetime,
+        # check to see if the UNTIL parameter value was a date
+        vals = dict(pair.split('=') for pair in
+                    value.upper().split(';'))
+        if len(vals.get('UNTIL', '')) == 8:
+            until = datetime.datetime.combine(until.date(),
+                                              dtstart.time())
+        # While RFC2445 says UNTIL MUST be UTC, Chandler allows
+        # floating recurring events, and uses floating UNTIL
+        # values. Also, some odd floating UNTIL but timezoned
+        # DTSTART values have shown up in the wild, so put
+        # floating UNTIL values DTSTART's timezone
+        if until.tzinfo is None:
+            until = until.replace(tzinfo=dtstart.tzinfo)
+
+        if dtstart.tzinfo is not None:
+            until = until.astimezone(dtstart.tzinfo)
+
+        # RFC2445 actually states that UNTIL must be a UTC
+        # value. Whilst the changes above work OK, one problem
+        # case is if DTSTART is floating but UNTIL is properly
+        # specified as UTC (or with a TZID). In that case
+        # dateutil will fail datetime comparisons. There is no
+        # easy solution to this as there is no obvious timezone
+        # (at this point) to do proper floating time offset
+        # comparisons. The best we can do is treat the UNTIL
+        # value as floating. This could mean incorrect
+        # determination of the last instance. The better
+        # solution here is to encourage clients to use COUNT
+        # rather than UNTIL when DTSTART is floating.
+        if dtstart.tzinfo is None:
+            until = until.replace(tzinfo=None)
+
+    if parsed is not None:
+        rule = rrule.rrule(dtstart=dtstart, **kwargs)
+    else:
+        value_without_until = ';'.join(
+            pair for pair in value.split(';')
+            if pair.split('=')[0].upper() != 'UNTIL')
+        rule = rrule.rrulestr(value_without_until,
+                              dtstart=dtstart, ignoretz=ignoretz)
+    rule._until = until
+    return rule
+
+
+def sameDatetime(a, b):
+    """
+    Return True if a and b are the same date or datetime, in the same tzinfo.
+    """
+    return (type(a) is type(b) and a == b and
+            getattr(a, 'tzinfo', None) is getattr(b, 'tzinfo', None))
+
+
+def _bisectDay(year, month, test):
+    """
+    Return the last day of month not matching test.
+
+    test must not match the first of the month, and once it matches it must
+    keep matching for the rest of the month.
+    """
+    _datetime = datetime.datetime
+    lo, hi = 1, calendar.monthrange(year, month)[1]
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if test(_datetime(year, month, mid)):
+            hi = mid - 1
+        else:
+            lo = mid
+    return lo
+
+
+def _bisectHour(year, month, day, test):
+    """
+    Return the datetime of the last hour of day not matching test.
+
+    Same preconditions as _bisectDay, applied to the hours of the day.
+    """
+    _datetime = datetime.datetime
+    lo, hi = 0, 23
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if test(_datetime(year, month, day, mid)):
+            hi = mid - 1
         else:
-            for hour in hours:
-                yield datetime.datetime(year, month, day, hour)
+            lo = mid
+    return datetime.datetime(year, month, day, lo)
+
 
-    assert transitionTo in ('daylight', 'standard')
+def _isLastHour(dt, year, month, test):
+    """
+    Return True if dt is the hour _bisectDay and _bisectHour would find.
+    """
+    if dt.year != year or dt.month != month:
+        return False
+    midnight = datetime.datetime(year, month, dt.day)
+    if test(midnight) or test(dt):
+        return False
+    if (dt.day < calendar.monthrange(year, month)[1] and
+            not test(midnight + datetime.timedelta(days=1))):
+        return False
+    return dt.hour == 23 or test(dt + datetime.timedelta(hours=1))
+
+
+def getTransition(transitionTo, year, tzinfo, dst=None, hint=None):
+    """
+    Return the datetime of the transition to/from DST, or None.
+
+    dst may be given to replace tzinfo.dst, e.g. by a memoized version.
+
+    hint may be given as the expected transition, e.g. from last year's
+    rule. It's confirmed with a few probes instead of searching the month.
+    """
+    if dst is None:
+        dst = tzinfo.dst
+
+    assert transitionTo in PHASES
     if transitionTo == 'daylight':
         def test(dt):
             try:
-                return tzinfo.dst(dt) != zeroDelta
+                return dst(dt) != zeroDelta
             except pytz.NonExistentTimeError:
                 return True  # entering daylight time
             except pytz.AmbiguousTimeError:
@@ -2026,30 +2234,71 @@ def getTransition(transitionTo, year, tzinfo):
     elif transitionTo == 'standard':
         def test(dt):
             try:
-                return tzinfo.dst(dt) == zeroDelta
+                return dst(dt) == zeroDelta
             except pytz.NonExistentTimeError:
                 return False  # entering daylight time
             except pytz.AmbiguousTimeError:
                 return True  # entering standard time
-    newyear = datetime.datetime(year, 1, 1)
-    monthDt = firstTransition(generateDates(year), test)
-    if monthDt is None:
-        return newyear
-    elif monthDt.month == 12:
+    # test the first day of each month once, then look for the first month
+    # not matching test which is followed by one that does
+    _datetime = datetime.datetime
+    flags = [test(_datetime(year, month, 1)) for month in range(1, 13)]
+    if all(flags):
+        return _datetime(year, 1, 1)
+    for month in range(1, 12):
+        if flags[month] and not flags[month - 1]:
+            break
+    else:
         return None
+    # there was a good transition somewhere in a non-December month,
+    # transitions are never within a month of one another, so test is
+    # monotonic over the days of that month and the hours of the day
+    if transitionTo == 'standard':
+        # assuming tzinfo.dst returns a new offset for the first
+        # possible hour, we need to add one hour for the offset change
+        # and another hour because _bisectHour returns the hour
+        # before the transition
+        correction = datetime.timedelta(hours=2)
     else:
-        # there was a good transition somewhere in a non-December month
-        month = monthDt.month
-        day = firstTransition(generateDates(year, month), test).day
-        uncorrected = firstTransition(generateDates(year, month, day), test)
-        if transitionTo == 'standard':
-            # assuming tzinfo.dst returns a new offset for the first
-            # possible hour, we need to add one hour for the offset change
-            # and another hour because firstTransition returns the hour
-            # before the transition
-            return uncorrected + datetime.timedelta(hours=2)
+        correction = datetime.timedelta(hours=1)
+    if hint is not None and _isLastHour(hint - correction, year, month,
+                                        test):
+        return hint
+    day = _bisectDay(year, month, test)
+    return _bisectHour(year, month, day, test) + correction
+
+
+def getTransitionOccurrence(year, month, dayofweek, n, hour):
+    """
+    Return the datetime of the first transition on or after year.
+
+    The transition happens at hour on the nth dayofweek (0 is Monday) of
+    month, counting from the end of the month if n is negative, or on the
+    first one if n is None.  If hour is None the offset applies to the whole
+    year, so return new year's day.
+
+    Equivalent to the first occurrence of a YEARLY rrule starting in year,
+    without building one.  Raise ValueError if abs(n) isn't between 1 and 5,
+    since no month has that occurrence.
+    """
+    if hour is None:
+        # all year offset, with no rule
+        return datetime.datetime(year, 1, 1)
+    if n is None:
+        n = 1
+    if not 1 <= abs(n) <= 5:
+        raise ValueError("No month has occurrence {0} of a weekday".format(n))
+    while True:
+        firstWeekday, daysInMonth = calendar.monthrange(year, month)
+        if n > 0:
+            day = 1 + (dayofweek - firstWeekday) % 7 + (n - 1) * 7
         else:
-            return uncorrected + datetime.timedelta(hours=1)
+            lastWeekday = (firstWeekday + daysInMonth - 1) % 7
+            day = daysInMonth - (lastWeekday - dayofweek) % 7 + (n + 1) * 7
+        if 1 <= day <= daysInMonth:
+            return datetime.datetime(year, month, day, hour)
+        # no such weekday this year, e.g. a fifth Sunday
+        year += 1
 
 
 def tzinfo_eq(tzinfo1, tzinfo2, startYear=2000, endYear=2020):
@@ -2069,7 +2318,7 @@ def tzinfo_eq(tzinfo1, tzinfo2, startYear=2000, endYear=2020):
     if not dt_test(datetime.datetime(startYear, 1, 1)):
         return False
     for year in range(startYear, endYear):
-        for transitionTo in 'daylight', 'standard':
+        for transitionTo in PHASES:
             t1 = getTransition(transitionTo, year, tzinfo1)
             t2 = getTransition(transitionTo, year, tzinfo2)
             if t1 != t2 or not dt_test(t1):
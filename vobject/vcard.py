@@ -1,5 +1,6 @@
 """Definitions and behavior for vCard 3.0"""
 
+import base64
 import codecs
 
 from . import behavior
@@ -148,9 +149,9 @@ class VCardTextBehavior(behavior.Behavior):
             encoding = getattr(line, 'encoding_param', None)
             if encoding and encoding.upper() == cls.base64string:
                 if isinstance(line.value, bytes):
-                    line.value = codecs.encode(line.value, "base64").decode("utf-8").replace('\n', '')
+                    line.value = base64.b64encode(line.value).decode("utf-8")
                 else:
-                    line.value = codecs.encode(line.value.encode(encoding), "base64").decode("utf-8")
+                    line.value = base64.b64encode(line.value.encode("utf-8")).decode("utf-8")
             else:
                 line.value = backslashEscape(line.value)
             line.encoded = True